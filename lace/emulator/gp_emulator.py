@@ -4,11 +4,20 @@ import pickle
 import matplotlib.pyplot as plt
 import os
 import json
-from scipy.spatial import Delaunay
+import hashlib
+from scipy.spatial import Delaunay, cKDTree
+from scipy.spatial.distance import cdist
 from scipy.interpolate import interp1d
+from scipy.linalg import solve_triangular
 from lace.emulator import p1d_archive
 from lace.emulator import poly_p1d
 
+## Configuration keys used to match emulators saved
+## before the full training set was saved alongside them
+LEGACY_INIT_PARAMS=["k_bin","emu_type","emu_noise","drop_tau_rescalings",
+                "drop_temp_rescalings","keep_every_other_rescaling",
+                "undersample_z","paramList","asymmetric_kernel","z_max"]
+
 class GPEmulator:
     """
     Gaussian process emulator to emulate P1D from a simulation suite.
@@ -27,7 +36,8 @@ class GPEmulator:
                 emu_per_k=False,
                 reduce_var_k=False,
                 reduce_var_z=False,
-                reduce_var_mf=False):
+                reduce_var_mf=False,
+                saved_emulator=None):
 
         self.kmax_Mpc=kmax_Mpc
         self.basedir=basedir
@@ -46,9 +56,17 @@ class GPEmulator:
                             ## inside the training set
         self.rbf_only=rbf_only
         self.emu_per_k=emu_per_k
+        self.checkHulls=checkHulls ## Build a Delaunay hull of the training set
         self.reduce_var_k=reduce_var_k ## Emulate (1+k)P1D(k)
         self.reduce_var_z=reduce_var_z ## Emulate P1D(k)/(1+z)^3.8
         self.reduce_var_mf=reduce_var_mf ## Emulate P1D(k)*<F>^2.5
+        self.emulators=None ## Flag that this is an individual emulator object
+
+        ## Build a trained emulator from a file written by saveEmulator,
+        ## without reading an archive
+        if saved_emulator is not None:
+            self._restore_saved_emulator(saved_emulator)
+            return
 
         # read all files with P1D measured in simulation suite
         if passarchive==None:
@@ -68,6 +86,8 @@ class GPEmulator:
         ## Find max k bin
         self.k_bin=np.max(np.where(self.archive.data[0]["k_Mpc"]<self.kmax_Mpc))+1
         self.training_k_bins=self.archive.data[0]["k_Mpc"][1:self.k_bin]
+        self._interp_k=None ## k bins of the cached interpolation weights
+        self._logk_k=None ## k bins of the cached log(k)
         ## If none, take all parameters
         if paramList==None:
         	self.paramList=['mF', 'sigT_Mpc', 'gamma', 'kF_Mpc', 'Delta2_p', 'n_p']
@@ -81,27 +101,27 @@ class GPEmulator:
             self.train()
 
 
-        self.checkHulls=checkHulls
-        if self.checkHulls:
-            self.hull=Delaunay(self.X_param_grid)
-        else:
-            self.hull=None
-        self.emulators=None ## Flag that this is an individual emulator object
-
-
     def _training_points_k_bin(self,archive):
         ''' Method to get the Y training points in the form of the P1D
         at different k values '''
 
-        P1D_k=np.empty([len(self.archive.data),self.k_bin-1])
-        for aa in range(len(self.archive.data)):
-            P1D_k[aa]=self.archive.data[aa]['p1d_Mpc'][1:self.k_bin]
-            if self.reduce_var_k:
-                P1D_k[aa]*=(1+self.training_k_bins)
-            if self.reduce_var_z:
-                P1D_k[aa]*=1./((1+self.archive.data[aa]["z"])**3.8)
-            if self.reduce_var_mf:
-                P1D_k[aa]*=((self.archive.data[aa]["mF"])**2)
+        data=archive.data
+        k_bin=self.k_bin
+        ## archiveP1D keeps an (N,Nk) array in sync with its entries,
+        ## copy it as it is rescaled below
+        if (isinstance(archive,p1d_archive.archiveP1D)
+                    and getattr(archive,"p1d_Mpc",None) is not None):
+            P1D_k=archive.p1d_Mpc[:,1:k_bin].copy()
+        else:
+            P1D_k=np.stack([entry['p1d_Mpc'][1:k_bin] for entry in data])
+        if self.reduce_var_k:
+            P1D_k*=(1+self.training_k_bins)
+        if self.reduce_var_z:
+            z=self._archive_column(archive,"z")
+            P1D_k*=1./((1+z[:,None])**3.8)
+        if self.reduce_var_mf:
+            mF=self._archive_column(archive,"mF")
+            P1D_k*=(mF[:,None]**2)
 
         return P1D_k
 
@@ -111,20 +131,34 @@ class GPEmulator:
         coefficients '''
 
         self._fit_p1d_in_archive(4,self.kmax_Mpc)
-        coeffs=np.empty([len(self.archive.data),5]) ## Hardcoded to use 4th degree polynomial
-        for aa in range(len(self.archive.data)):
-            coeffs[aa]=self.archive.data[aa]['fit_p1d'] ## Collect P1D data for all k bins
+        data=self.archive.data
+        coeffs=np.empty([len(data),5]) ## Hardcoded to use 4th degree polynomial
+        for aa, entry in enumerate(data):
+            coeffs[aa]=entry['fit_p1d'] ## Collect P1D data for all k bins
 
         return coeffs
 
 
-    def _rescale_params(self,params,paramLimits):
-        ''' Rescale a set of parameters to have a unit volume '''
+    def _set_rescaling(self):
+        ''' Store the offset and inverse width of each parameter range,
+        so that rescaling to unit volume is one subtraction and one
+        multiplication per parameter '''
+
+        self._lo=self.paramLimits[:,0]
+        self._inv_span=1./(self.paramLimits[:,1]-self.paramLimits[:,0])
 
-        for aa in range(len(params)):
-            params[aa]=((params[aa]-paramLimits[aa,0])/(paramLimits[aa,1]-paramLimits[aa,0]))
+        return
+
+
+    def _rescaled_vector(self,model):
+        ''' For a given model in dictionary format, return the emulator
+        parameters as an array rescaled to unit volume '''
 
-        return params
+        param=np.array([model[par] for par in self.paramList],dtype=np.float64)
+        param-=self._lo
+        param*=self._inv_span
+
+        return param
 
 
     def _buildTrainingSets(self,archive,paramList):
@@ -134,9 +168,6 @@ class GPEmulator:
         the number of k bins for the k bin emulator, or number of polynomial
         coefficients for the polyfit emulator '''
 
-        ## Grid that will contain all training params
-        params=np.empty([len(self.archive.data),len(paramList)])
-
         if self.emu_type=="k_bin":
             trainingPoints=self._training_points_k_bin(archive)
         elif self.emu_type=="polyfit":
@@ -145,13 +176,27 @@ class GPEmulator:
             print("Unknown emulator type, terminating")
             quit()
 
-        for aa in range(len(self.archive.data)):
-            for bb in range(len(paramList)):
-                params[aa][bb]=archive.data[aa][paramList[bb]] ## Populate parameter grid
+        ## Grid that will contain all training params
+        params=np.column_stack([self._archive_column(archive,par)
+                        for par in paramList])
 
         return params,trainingPoints
 
 
+    def _archive_column(self,archive,key):
+        ''' Return the values of key for all entries in the archive.
+        archiveP1D objects keep 1D arrays for each parameter in sync
+        with their entries, so we use those. For other archive objects
+        we gather the values from the entries '''
+
+        if isinstance(archive,p1d_archive.archiveP1D) and hasattr(archive,key):
+            return getattr(archive,key)
+
+        data=archive.data
+        return np.fromiter((entry[key] for entry in data),
+                        dtype=np.float64,count=len(data))
+
+
     def _fit_p1d_in_archive(self,deg,kmax_Mpc):
         """For each entry in archive, fit polynomial to log(p1d)"""
         
@@ -169,36 +214,57 @@ class GPEmulator:
         of the provided params, not by defining our own prior volume. Need to decide
         whether or not this is what we want. '''
 
-        self.X_param_grid,self.Ypoints=self._buildTrainingSets(archive,paramList)
+        self.X_param_grid,Ypoints=self._buildTrainingSets(archive,paramList)
+
+        ## Fingerprint of the raw training set, used to match saved
+        ## emulators to the data they were trained on
+        training_set=hashlib.sha1(self.X_param_grid.tobytes())
+        training_set.update(Ypoints.tobytes())
+        self.training_set_hash=training_set.hexdigest()
 
         ## Get parameter limits for rescaling
         if self.paramLimits is None:
             self.paramLimits=self._get_param_limits(self.X_param_grid)
 
-        ## Rescaling to unit volume
-        for cc in range(len(self.archive.data)):
-            self.X_param_grid[cc]=self._rescale_params(self.X_param_grid[cc],self.paramLimits)
+        ## Rescaling to unit volume, in place over the whole grid
+        self._set_rescaling()
+        self.X_param_grid-=self._lo
+        self.X_param_grid*=self._inv_span
         if self.verbose:
             print("Rescaled params to unity volume")
 
+        self._build_search_structures()
+
         ## Factors by which to rescale the flux to set a mean of 0
-        self.scalefactors = np.median(self.Ypoints, axis=0)
+        self.scalefactors = np.median(Ypoints, axis=0)
 
-        #Normalise by the median value
-        self.normspectra = (self.Ypoints/self.scalefactors) -1.
+        #Normalise by the median value, in place as the training
+        #points are not needed after this
+        np.divide(Ypoints,self.scalefactors,out=Ypoints)
+        Ypoints-=1.
+        self.normspectra=Ypoints
+
+        self._build_gp()
+
+        return
+
+
+    def _build_gp(self):
+        ''' Set up the GP object(s) on the rescaled training grid and
+        normalised spectra '''
 
         if self.rbf_only==False:
-            kernel = GPy.kern.Linear(len(paramList),ARD=self.asymmetric_kernel)
-            kernel += GPy.kern.RBF(len(paramList),ARD=self.asymmetric_kernel)
+            kernel = GPy.kern.Linear(len(self.paramList),ARD=self.asymmetric_kernel)
+            kernel += GPy.kern.RBF(len(self.paramList),ARD=self.asymmetric_kernel)
         else:
-            kernel = GPy.kern.RBF(len(paramList),ARD=self.asymmetric_kernel)
+            kernel = GPy.kern.RBF(len(self.paramList),ARD=self.asymmetric_kernel)
         
         if self.emu_per_k:
             ## Build a GP for each k bin
             self.gp=[]
-            for aa in range(len(self.training_k_bins)):
-                p1d_k=self.normspectra[:,aa]
-                self.gp.append(GPy.models.GPRegression(self.X_param_grid,
+            X_param_grid=self.X_param_grid
+            for p1d_k in self.normspectra.T:
+                self.gp.append(GPy.models.GPRegression(X_param_grid,
                         p1d_k[:,None],
                         kernel=kernel,
                         noise_var=self.emu_noise,
@@ -208,34 +274,48 @@ class GPEmulator:
                     kernel=kernel,
                     noise_var=self.emu_noise,
                     initialize=False)
-        
+
+        return
+
+
+    def _build_search_structures(self):
+        ''' KD-tree of the rescaled training points for nearest
+        neighbour queries, and a lookup table of the training points.
+        The Delaunay triangulation, which gets very expensive in high
+        dimensions, is only built if checkHulls is set '''
+
+        self.tree=cKDTree(self.X_param_grid)
+        ## Training points by their rescaled parameter values, to check
+        ## if a prediction is made on one of them
+        self._train_hashes={tuple(row):aa for aa, row in enumerate(self.X_param_grid)}
+        if self.checkHulls:
+            self.hull=Delaunay(self.X_param_grid)
+        else:
+            self.hull=None
+
         return
 
 
     def _get_param_limits(self,paramGrid):
         ''' Get the min and max values for each parameter '''
 
-        paramLimits=np.empty((np.shape(paramGrid)[1],2))
-        for aa in range(len(paramLimits)):
-            paramLimits[aa,0]=min(paramGrid[:,aa])
-            paramLimits[aa,1]=max(paramGrid[:,aa])
-
-        return paramLimits
+        return np.stack([paramGrid.min(axis=0),paramGrid.max(axis=0)],axis=1)
 
 
     def train(self):
         ''' Train the GP emulator '''
 
 
+        Ntrain=len(self.X_param_grid)
         if self.emu_per_k:
             for gp in self.gp:
                 gp.initialize_parameter()
-                print("Training GP on %d points" % len(self.archive.data))
+                print("Training GP on %d points" % Ntrain)
                 status = gp.optimize(messages=False)
                 print("Optimised")
         else:
             self.gp.initialize_parameter()
-            print("Training GP on %d points" % len(self.archive.data))
+            print("Training GP on %d points" % Ntrain)
             status = self.gp.optimize(messages=False)
             print("Optimised")
 
@@ -244,6 +324,62 @@ class GPEmulator:
         return
 
 
+    def _kernel_row(self,kern,X):
+        ''' Closed form of the Linear and RBF kernels for an (M,D) array
+        of rescaled points. Returns the (M,N) covariance with the training
+        points and the (M,) prior variance of the points themselves '''
+
+        if isinstance(kern,GPy.kern.Add):
+            parts=kern.parts
+        else:
+            parts=[kern]
+
+        k_star=np.zeros((len(X),len(self.X_param_grid)))
+        k_diag=np.zeros(len(X))
+        for part in parts:
+            if isinstance(part,GPy.kern.Linear):
+                variances=part.variances.values
+                k_star+=np.dot(X*variances,self.X_param_grid.T)
+                k_diag+=np.sum(variances*X**2,axis=1)
+            elif isinstance(part,GPy.kern.RBF):
+                variance=part.variance.values[0]
+                lengthscale=part.lengthscale.values
+                ## (M,N) squared distances, in units of the lengthscale
+                r2=cdist(X/lengthscale,self.X_param_grid/lengthscale,'sqeuclidean')
+                k_star+=variance*np.exp(-0.5*r2)
+                k_diag+=variance
+            else:
+                raise ValueError("Unsupported kernel "+part.name)
+
+        return k_star,k_diag
+
+
+    def _predict_unit(self,X):
+        ''' Return the GP mean and variance (including the likelihood
+        noise) for an (M,D) array of points rescaled to unit volume.
+        The Cholesky factor L of the training covariance K_yy and the
+        weight vector alpha=K_yy^-1 y are kept up to date by GPy, so we
+        only need the kernel between the query points and the training set '''
+
+        if self.emu_per_k:
+            gps=self.gp
+        else:
+            gps=[self.gp]
+
+        pred=[]
+        var=[]
+        for gp in gps:
+            L=gp.posterior.woodbury_chol
+            alpha=gp.posterior.woodbury_vector
+            k_star,k_diag=self._kernel_row(gp.kern,X)
+            pred.append(np.dot(k_star,alpha))
+            v=solve_triangular(L,k_star.T,lower=True,check_finite=False)
+            noise_var=gp.likelihood.variance.values[0]
+            var.append((k_diag-np.sum(v**2,axis=0)+noise_var)[:,None])
+
+        return np.hstack(pred),np.hstack(var)
+
+
     def printPriorVolume(self):
         ''' Print the limits for each parameter '''
 
@@ -256,23 +392,25 @@ class GPEmulator:
         ordered parameter list with the values rescaled to unit volume
         '''
 
-        param=[]
-        for aa, par in enumerate(self.paramList):
-            ## Rescale input parameters
-            param.append(model[par])
-            param[aa]=(param[aa]-self.paramLimits[aa,0])/(self.paramLimits[aa,1]-self.paramLimits[aa,0])
-        return param
+        return list(self._rescaled_vector(model))
 
 
     def check_in_hull(self,model):
-        param=[]
-        for aa, par in enumerate(self.paramList):
-            ## Rescale input parameters
-            param.append(model[par])
-            param[aa]=(param[aa]-self.paramLimits[aa,0])/(self.paramLimits[aa,1]-self.paramLimits[aa,0])
-        
-        return self.hull.find_simplex(np.array(param).reshape(1,-1))<0
-        
+        ''' Return True if the model is outside the convex hull
+        of the training points '''
+
+        param=self._rescaled_vector(model)
+
+        ## Points outside the bounding box of the training set
+        ## cannot be inside the hull
+        if (param<self.tree.mins).any() or (param>self.tree.maxes).any():
+            return np.array([True])
+
+        if self.hull is None:
+            self.hull=Delaunay(self.X_param_grid)
+
+        return self.hull.find_simplex(param[None,:])<0
+
 
     def predict(self,model,z=None):
         ''' Return P1D or polyfit coeffs for a given parameter set
@@ -281,40 +419,52 @@ class GPEmulator:
         if self.trained==False:
             print("Emulator not trained, cannot make a prediction")
             return
-        param=[]
-        for aa, par in enumerate(self.paramList):
-            ## Rescale input parameters
-            param.append(model[par])
-            param[aa]=(param[aa]-self.paramLimits[aa,0])/(self.paramLimits[aa,1]-self.paramLimits[aa,0])
-        ## Check if model is inside training set
+        param=self._rescaled_vector(model)
+        ## Check if model is one of the training points
         if self.crossval==True:
-            isin=np.isin(param,self.X_param_grid)
-            if np.sum(isin)==len(param): ## Check all parameters
+            if tuple(param) in self._train_hashes:
                 print("Emulator call is inside training set!!!")
 
-        if self.emu_per_k:
-            pred=np.array([])
-            err=np.array([])
-            for gp in self.gp:
-                pred_single,err_single=gp.predict(np.array(param).reshape(1,-1))
-                pred=np.append(pred,pred_single)
-                err=np.append(err,err_single)
-        else:
-            pred,err=self.gp.predict(np.array(param).reshape(1,-1))
+        pred,err=self._predict_unit(param[None,:])
+        out_pred,out_err=self._unscale_prediction(pred,err,[model],z)
+
+        return out_pred[0],out_err[0]
+
+
+    def predict_batch(self,models,z=None):
+        ''' Return P1D or polyfit coeffs for a list of parameter sets,
+        evaluating the GP once for all of them. z can be a single value
+        or one value per model. Returns arrays of shape (len(models),n_k) '''
+
+        if self.trained==False:
+            print("Emulator not trained, cannot make a prediction")
+            return
+
+        X=np.stack([self._rescaled_vector(model) for model in models])
+        pred,err=self._predict_unit(X)
+
+        return self._unscale_prediction(pred,err,models,z)
+
+
+    def _unscale_prediction(self,pred,err,models,z):
+        ''' Undo the normalisation of the training spectra for an (M,n_k)
+        set of GP predictions and variances, one row per model '''
 
-        out_pred=np.ndarray.flatten((pred+1)*self.scalefactors)
-        out_err=np.ndarray.flatten(np.sqrt(err)*self.scalefactors)
+        out_pred=(pred+1)*self.scalefactors
+        out_err=np.sqrt(err)*self.scalefactors
 
         if self.reduce_var_k:
             out_pred*=1./(1+self.training_k_bins)
             out_err*=1./(1+self.training_k_bins)
         if self.reduce_var_z:
-            out_pred*=((1+z)**3.8)
-            out_err*=((1+z)**3.8)
+            zfactor=((1+np.asarray(z,dtype=np.float64).reshape(-1,1))**3.8)
+            out_pred*=zfactor
+            out_err*=zfactor
         if self.reduce_var_mf:
-            out_pred*=1./(model["mF"]**2)
-            out_err*=1./(model["mF"]**2)
-       
+            mF=np.array([model["mF"] for model in models])[:,None]
+            out_pred*=1./(mF**2)
+            out_err*=1./(mF**2)
+
         return out_pred,out_err
 
 
@@ -333,28 +483,35 @@ class GPEmulator:
                 print(max(k_Mpc))
                 print(max(self.training_k_bins))
                 print("Warning! Your requested k bins are higher than the training values.")
-        pred,err=self.predict(model,z)
+        ## A list of models is emulated with a single GP call, returning
+        ## one row per model
+        if isinstance(model,(list,tuple)):
+            pred,err=self.predict_batch(model,z)
+        else:
+            pred,err=self.predict(model,z)
         ## Use cubic interpolation to return prediction for arbitrary
         ## k bins
         if self.emu_type=="k_bin":
-            interpolator=interp1d(self.training_k_bins,pred,"cubic")
-            interpolated_P=interpolator(k_Mpc)
+            weights=self._cubic_weights(k_Mpc)
+            interpolated_P=np.dot(pred,weights.T)
         elif self.emu_type=="polyfit":
-            poly=np.poly1d(pred)
-            err=np.abs(err)
-            interpolated_P=np.exp(poly(np.log(k_Mpc)))
-            err=(err[0]*interpolated_P**4+err[1]*interpolated_P**3+err[2]*interpolated_P**2+err[3]*interpolated_P)
-            covar = np.outer(err, err)
+            ## Move coefficients to the first axis so that np.polyval
+            ## broadcasts over models
+            coeffs=np.moveaxis(pred,-1,0)[...,None]
+            err=np.moveaxis(np.abs(err),-1,0)[...,None]
+            interpolated_P=np.exp(np.polyval(coeffs,self._log_k(k_Mpc)))
+            ## err[0]*P**4+err[1]*P**3+err[2]*P**2+err[3]*P, using Horner's method
+            err=np.polyval(err[:4],interpolated_P)*interpolated_P
+            covar=err[...,:,None]*err[...,None,:]
         if return_covar==True:
             if self.emu_type=="k_bin":
-                error_interp=interp1d(self.training_k_bins,err, "cubic")
-                error=error_interp(k_Mpc)
+                error=np.dot(err,weights.T)
                 if self.emu_per_k:
-                    covar=np.diag(error**2)
+                    covar=error[...,:,None]**2*np.eye(error.shape[-1])
                 else:
                     ## For now, assume that we have fully correlated errors
                     ## when using same hyperparams
-                    covar = np.outer(error, error)
+                    covar=error[...,:,None]*error[...,None,:]
                 return interpolated_P, covar
             else:
                 return interpolated_P, covar
@@ -362,26 +519,45 @@ class GPEmulator:
             return interpolated_P
 
 
+    def _cubic_weights(self,k_Mpc):
+        ''' Return the matrix W such that np.dot(W,y) is the cubic
+        interpolation at k_Mpc of values y in the training k bins.
+        A cubic spline is linear in the interpolated values, so W only
+        depends on the k bins. It is cached for the last k_Mpc requested,
+        as this is usually fixed over many calls '''
+
+        k_Mpc=np.asarray(k_Mpc,dtype=np.float64)
+        if self._interp_k is None or not np.array_equal(self._interp_k,k_Mpc):
+            identity=np.eye(len(self.training_k_bins))
+            interpolator=interp1d(self.training_k_bins,identity,"cubic",axis=0)
+            self._interp_weights=interpolator(k_Mpc)
+            self._interp_k=k_Mpc.copy()
+
+        return self._interp_weights
+
+
+    def _log_k(self,k_Mpc):
+        ''' Return log(k_Mpc), cached for the last k_Mpc requested
+        as this is usually fixed over many calls '''
+
+        k_Mpc=np.asarray(k_Mpc,dtype=np.float64)
+        if self._logk_k is None or not np.array_equal(self._logk_k,k_Mpc):
+            self._logk=np.log(k_Mpc)
+            self._logk_k=k_Mpc.copy()
+
+        return self._logk
+
+
     def get_nearest_distance(self,model,z=None):
         ''' For a given model, get the Euclidean distance to the nearest
         training point (in the rescaled parameter space)'''
 
-        param=[] ## List of input emulator parameter values
         ## First rescale the input model to unit volume
-        for aa, par in enumerate(self.paramList):
-            ## Rescale input parameters
-            param.append(model[par])
-            param[aa]=(param[aa]-self.paramLimits[aa,0])/(self.paramLimits[aa,1]-self.paramLimits[aa,0])
-        
-        ## Find the closest training point, and find the Euclidean
-        ## distance to that point
-        shortest_distance=99.99 ## Initialise variable
-        for training_point in self.X_param_grid:
-            ## Get Euclidean distance between the training point and
-            ## the prediction point
-            new_distance=np.sqrt(np.sum((training_point-param)**2))
-            if new_distance < shortest_distance:
-                shortest_distance=new_distance
+        param=self._rescaled_vector(model)
+
+        ## Query the KD-tree for the Euclidean distance to the
+        ## closest training point
+        shortest_distance,_=self.tree.query(param)
 
         return shortest_distance
 
@@ -390,38 +566,21 @@ class GPEmulator:
         ''' Return a dictionary with the emulator parameters
         for a given training point '''
         
+        entry=self.archive.data[point_number]
         model_dict={}
         for param in self.paramList:
-            model_dict[param]=self.archive.data[point_number][param]
+            model_dict[param]=entry[param]
         
         return model_dict
 
 
-    def saveEmulator(self):
-        ''' Method to save a trained emulator. The emulator
-        hyperparameters are saved alongside a .json dictionary
-        detailing the initial configuration of the emulator.
-        When an emulator is saved it will check the basedir
-        for existing emulator saves.
-        
-        We currently do not save emulators on custom archives
-        as it is impossible to know if the training points
-        are all the same. Training points are currently
-        reassembled using the snapshot archive, and not
-        saved alongside the emulator hyperparameters. '''
-
-        ## Perform checks
-        if self.custom_archive or self.max_archive_size:
-            print("Cannot save emulators trained on custom archives")
-            return
-        if not self.trained:
-            print("Cannot save an emulator that is not trained")
-            return
+    def _get_init_params(self):
+        ''' Dictionary with the configuration of the emulator, used
+        to match saved emulators against the current setup '''
 
-        ## Create and save dictionary of emulator parameters
         ## Can't think of a way to do this iteratively so we write it out
         initParams={}
-        initParams["k_bin"]=self.k_bin
+        initParams["k_bin"]=int(self.k_bin)
         initParams["emu_type"]=self.emu_type
         initParams["emu_noise"]=self.emu_noise
         initParams["drop_tau_rescalings"]=self.drop_tau_rescalings
@@ -431,93 +590,199 @@ class GPEmulator:
         initParams["paramList"]=self.paramList
         initParams["asymmetric_kernel"]=self.asymmetric_kernel
         initParams["z_max"]=self.z_max
+        ## Kernel and output configuration
+        initParams["rbf_only"]=self.rbf_only
+        initParams["emu_per_k"]=self.emu_per_k
+        initParams["reduce_var_k"]=self.reduce_var_k
+        initParams["reduce_var_z"]=self.reduce_var_z
+        initParams["reduce_var_mf"]=self.reduce_var_mf
+        initParams["paramLimits"]=np.asarray(self.paramLimits).tolist()
+        ## Identify the training set, so that we never load an emulator
+        ## trained on a different archive (e.g. for cross-validation)
+        initParams["training_set"]=self.training_set_hash
+
+        return initParams
+
+
+    def _find_saved_emulator(self,initParams):
+        ''' Look through the saved emulators in basedir for one with
+        a matching configuration. Returns the save string of the match
+        (or None), and the first free save string '''
+
+        basedir=self.basedir
+        if basedir is None:
+            basedir=getattr(self.archive,"basedir",None)
+        if basedir is None:
+            raise ValueError("No basedir to look for saved emulators in")
+        saveString=basedir+"/saved_emulator_"
 
-        saveString=self.basedir+"/saved_emulator_"
-
-        ## Here we check to see if an emulator matching
-        ## our initial parameters is already saved
         aa=1
         while os.path.isfile(saveString+str(aa)+".json"):
             ## Load dictionary and check if the values are different
-            ## to the emulator we want to save
+            ## to the current emulator
             with open(saveString+str(aa)+".json") as json_file:  
                 fileInitDict=json.load(json_file)
-            if fileInitDict==initParams: ## If so we can break the loop
-                if self.verbose:
-                    print("This emulator is already saved.")
-                return
+            if fileInitDict==initParams:
+                return saveString+str(aa),None
             else: ## If not keep looking through saved emulators
                 aa+=1
 
-        saveString=saveString+str(aa)
+        return None,saveString+str(aa)
+
+
+    def saveEmulator(self):
+        ''' Method to save a trained emulator. Everything needed to
+        rebuild the trained GP is saved in a single .npz file: the
+        rescaled training grid, the normalised spectra, the scalefactors,
+        parameter limits, training k bins and the hyperparameters, so
+        that it can be rebuilt without an archive using saved_emulator.
+        A .json dictionary alongside it details the configuration of
+        the emulator and a fingerprint of its training set. When an
+        emulator is saved it will check the basedir for existing emulator
+        saves with the same configuration and training set. '''
+
+        ## Perform checks
+        if not self.trained:
+            print("Cannot save an emulator that is not trained")
+            return
+
+        initParams=self._get_init_params()
+
+        ## Here we check to see if an emulator matching
+        ## our initial parameters is already saved
+        savedString,saveString=self._find_saved_emulator(initParams)
+        if savedString is not None:
+            if self.verbose:
+                print("This emulator is already saved.")
+            return
+
         with open("%s.json" % saveString, 'w') as fp:
             json.dump(initParams, fp)
 
-        ## Create and save dictionary of hyperparameters
         saveDict={}
-        saveDict["paramList"]=self.paramList
-        saveDict["kmax_Mpc"]=self.kmax_Mpc
-        np.save('%s.npy' % saveString, self.gp.param_array)
+        saveDict["X_param_grid"]=self.X_param_grid
+        saveDict["normspectra"]=self.normspectra
+        saveDict["scalefactors"]=self.scalefactors
+        saveDict["paramLimits"]=self.paramLimits
+        saveDict["training_k_bins"]=self.training_k_bins
+        ## One set of hyperparameters per GP
+        if self.emu_per_k:
+            gps=self.gp
+        else:
+            gps=[self.gp]
+        for aa, gp in enumerate(gps):
+            saveDict["hyperparams_%d" % aa]=gp.param_array
+        np.savez('%s.npz' % saveString, **saveDict)
         if self.verbose:
-            print("Model saved as %s.npy" % saveString)
+            print("Model saved as %s.npz" % saveString)
 
 
     def loadEmulator(self):
-        ''' Method to load a saved set of emulator
-        hyperparameters. We need to make sure the
-        dataset and emulator configurations that the
-        hyperparameters were optimised on is the same
-        as the dataset we will use as training data.
-        So we will check the .json files for a perfect match '''
-
-        ## Perform same checks as when saving an emulator
-        ## as save/load does not work with non-standard
-        ## data archives
-
-        if self.custom_archive or self.max_archive_size:
-            print("Cannot load emulators with non-standard training data")
-            return
+        ''' Method to load the hyperparameters of a saved emulator.
+        We look for a saved emulator with the same configuration,
+        parameter limits and training set in the .json files. As the
+        training set is the same, only the hyperparameters are read.
+        Emulators trained on a different archive are never loaded.
+        To build an emulator without reading an archive, use the
+        saved_emulator argument instead. '''
+
         if self.trained:
             print("Cannot load an emulator after training")
             return
 
-        initParams={}
-        initParams["k_bin"]=self.k_bin
-        initParams["emu_type"]=self.emu_type
-        initParams["emu_noise"]=self.emu_noise
-        initParams["drop_tau_rescalings"]=self.drop_tau_rescalings
-        initParams["drop_temp_rescalings"]=self.drop_temp_rescalings
-        initParams["keep_every_other_rescaling"]=self.keep_every_other_rescaling
-        initParams["undersample_z"]=self.undersample_z
-        initParams["paramList"]=self.paramList
-        initParams["asymmetric_kernel"]=self.asymmetric_kernel
-        initParams["z_max"]=self.z_max
-
-        saveString=self.basedir+"/saved_emulator_"
+        initParams=self._get_init_params()
 
         ## Here we check to see if an emulator matching
         ## our initial parameters is already saved
-        aa=1
-        while os.path.isfile(saveString+str(aa)+".json"):
-            ## Load dictionary and check if the values are different
-            ## to the emulator we want to load
-            with open(saveString+str(aa)+".json") as json_file:  
-                fileInitDict=json.load(json_file)
-            if fileInitDict==initParams: ## If so, load it
-                saveString=saveString+str(aa)
-                self.gp.update_model(False)
-                self.gp.initialize_parameter()
-                self.gp[:]=np.load(saveString+".npy")
-                self.gp.update_model(True)
-                self.trained=True
+        saveString,_=self._find_saved_emulator(initParams)
+        if saveString is not None:
+            with np.load(saveString+".npz") as saved:
+                hyperparams=self._saved_hyperparams(saved)
+            self._set_hyperparams(hyperparams)
+            if self.verbose:
+                print("Loading emulator from %s.npz" % saveString)
+            return
+
+        ## Emulators saved in the old format only stored the
+        ## hyperparameters in a .npy file, and were only saved
+        ## for the standard archive and default kernel and rescalings
+        if not (self.custom_archive or self.max_archive_size or self.rbf_only
+                or self.emu_per_k or self.reduce_var_k or self.reduce_var_z
+                or self.reduce_var_mf):
+            legacyParams={key:initParams[key] for key in LEGACY_INIT_PARAMS}
+            legacyString,_=self._find_saved_emulator(legacyParams)
+            if legacyString is not None and os.path.isfile(legacyString+".npy"):
+                self._set_hyperparams([np.load(legacyString+".npy")])
                 if self.verbose:
-                    print("Loading emulator from %s.npy" % saveString)
+                    print("Loading emulator from %s.npy" % legacyString)
                 return
-                
-            else: ## If not keep looking through saved emulators
-                aa+=1
+
+        print("Could not find a matching emulator to load")
+
+
+    def _saved_hyperparams(self,saved):
+        ''' List with the hyperparameters of each GP in a saved emulator '''
+
+        Ngp=sum(key.startswith("hyperparams_") for key in saved.files)
+
+        return [saved["hyperparams_%d" % aa] for aa in range(Ngp)]
+
+
+    def _set_hyperparams(self,hyperparams):
+        ''' Set the hyperparameters of each GP, from a list with one
+        set of hyperparameters per GP '''
+
+        if self.emu_per_k:
+            gps=self.gp
+        else:
+            gps=[self.gp]
+        for gp,gp_hyperparams in zip(gps,hyperparams):
+            gp.update_model(False)
+            gp.initialize_parameter()
+            gp[:]=gp_hyperparams
+            gp.update_model(True)
+        self.trained=True
+
+        return
+
+
+    def _restore_saved_emulator(self,saveString):
+        ''' Build a trained emulator from the .json and .npz files
+        written by saveEmulator, without reading an archive. Methods
+        that need the archive entries (e.g. get_param_dict) are not
+        available on such an emulator '''
+
+        with open(saveString+".json") as json_file:
+            initParams=json.load(json_file)
+
+        self.custom_archive=True
+        self.archive=None
+        for key in ["k_bin","emu_type","emu_noise","drop_tau_rescalings",
+                    "drop_temp_rescalings","keep_every_other_rescaling",
+                    "undersample_z","paramList","asymmetric_kernel","z_max",
+                    "rbf_only","emu_per_k","reduce_var_k","reduce_var_z",
+                    "reduce_var_mf"]:
+            setattr(self,key,initParams[key])
+        self.training_set_hash=initParams["training_set"]
+
+        with np.load(saveString+".npz") as saved:
+            self.X_param_grid=saved["X_param_grid"]
+            self.normspectra=saved["normspectra"]
+            self.scalefactors=saved["scalefactors"]
+            self.paramLimits=saved["paramLimits"]
+            self.training_k_bins=saved["training_k_bins"]
+            hyperparams=self._saved_hyperparams(saved)
+        self._interp_k=None
+        self._logk_k=None
+
+        self._set_rescaling()
+        self._build_search_structures()
+        self._build_gp()
+        self._set_hyperparams(hyperparams)
         if self.verbose:
-            print("Could not find a matching emulator to load")
+            print("Built emulator from %s.npz" % saveString)
+
+        return
 
 
     def load_default(self):
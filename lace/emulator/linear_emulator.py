@@ -3,6 +3,7 @@ import sys
 import os
 import json
 import scipy.interpolate
+import scipy.spatial
 from lace.emulator import p1d_archive
 from lace.emulator import poly_p1d
 
@@ -38,7 +39,7 @@ class LinearEmulator(object):
                     emulate_growth=emulate_growth,
                     emulate_pressure=emulate_pressure)
 
-        # for each order in polynomial, setup interpolation object
+        # setup interpolation object for the polynomial coefficients
         self._setup_interp(deg)
         
 
@@ -72,26 +73,25 @@ class LinearEmulator(object):
 
 
     def _setup_interp(self,deg):
-        """For each order in polynomial, setup interpolation object"""
+        """Setup a single interpolation object for all polynomial coefficients"""
 
-        # for each parameter in params, get values from archive
-        point_params=[]
-        for par in self.params:
-            values = np.array([entry[par] for entry in self.archive.data])
-            point_params.append(values)
-        self.points=np.vstack(point_params).transpose()
-
-        N=len(self.archive.data)
-        self.linterps=[]
-        for p in range(deg+1):
-            print('setup interpolator for coefficient',p)
-            values = [entry['fit_p1d'].lnP[p] for entry in self.archive.data] 
-            linterp = scipy.interpolate.LinearNDInterpolator(self.points,values)
-            self.linterps.append(linterp)
-            # it is good to try the interpolator to finish the setup
-            # (it might help to avoid thread issues later on)
-            test_point=np.median(self.points,axis=0)
-            print(test_point,'test',linterp(test_point))
+        # for each parameter in params, use the 1D array stored in archive
+        # (the archive is built here and keeps these in sync with its entries)
+        self.points=np.column_stack([getattr(self.archive,par)
+                                        for par in self.params])
+
+        # triangulate parameter space once, shared by all coefficients
+        tri=scipy.spatial.Delaunay(self.points)
+
+        # polynomial coefficients for each entry, shape (N,deg+1),
+        # in the same order as PolyP1D.lnP_fit (highest power first)
+        values=np.array([entry['fit_p1d'].lnP_fit for entry in self.archive.data])
+        print('setup interpolator for %d coefficients'%(deg+1))
+        self.linterp=scipy.interpolate.LinearNDInterpolator(tri,values)
+        # it is good to try the interpolator to finish the setup
+        # (it might help to avoid thread issues later on)
+        test_point=np.median(self.points,axis=0)
+        print(test_point,'test',self.linterp(test_point))
 
 
     def _point_from_model(self,model):
@@ -113,19 +113,16 @@ class LinearEmulator(object):
         point = self._point_from_model(model)
         if self.verbose: print('evaluate point',point)
 
-        # emulate coefficients for PolyP1D object (note strange order of coeffs)
-        Npar=len(self.linterps)
-        coeffs=np.empty(Npar)
-        for i in range(Npar):
-            coeffs[Npar-i-1] = self.linterps[i](point)
-            # linear interpolation can not extrapolate
-            if np.isnan(coeffs[Npar-i-1]):
-                if self.verbose:
-                    print('linear emulator failed',point)
-                    if return_covar:
-                        return None,None
-                    else:
-                        return None
+        # emulate all coefficients for PolyP1D object in a single call
+        coeffs=self.linterp(point)[0]
+        # linear interpolation can not extrapolate
+        if np.isnan(coeffs).any():
+            if self.verbose:
+                print('linear emulator failed',point)
+                if return_covar:
+                    return None,None
+                else:
+                    return None
         if self.verbose: print('got coefficients',coeffs)
 
         # set P1D object
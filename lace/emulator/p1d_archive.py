@@ -55,6 +55,8 @@ class archiveP1D(object):
         
         if nearest_tau:
             self._keep_nearest_tau()
+            # keep 1D arrays in sync with the remaining entries
+            self._store_param_arrays()
 
         return
 
@@ -248,7 +250,8 @@ class archiveP1D(object):
 
 
     def _store_param_arrays(self):
-        """ create 1D arrays with all entries for a given parameter. """
+        """ create 1D arrays with all entries for a given parameter.
+            Should be called again whenever self.data is modified. """
 
         N=len(self.data)
 
@@ -269,6 +272,14 @@ class archiveP1D(object):
         if 'kF_Mpc' in self.data[0]:
             self.kF_Mpc=np.array([self.data[i]['kF_Mpc'] for i in range(N)])
 
+        # store P1D of all entries in a single (N,Nk) array (if measured,
+        # and all entries use the same number of k bins)
+        self.p1d_Mpc=None
+        if 'p1d_Mpc' in self.data[0]:
+            Nk=len(self.data[0]['p1d_Mpc'])
+            if all(len(entry['p1d_Mpc'])==Nk for entry in self.data):
+                self.p1d_Mpc=np.stack([entry['p1d_Mpc'] for entry in self.data])
+
         return
 
 
@@ -78,6 +78,8 @@ class ZEmulator:
                     aa+=1
                 else:
                     del copy_archive.data[aa]
+            # re-create 1D arrays with all entries for a given parameter
+            copy_archive._store_param_arrays()
             self.archive_list.append(copy_archive)
             
         return
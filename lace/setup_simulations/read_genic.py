@@ -119,11 +119,13 @@ def _build_cosmology_params_camb(config):
     return params
 
 
-def class_from_genic(paramfile, verbose=False):
-    """Parse a GenIC parameter file and returns a dictionary to setup CLASS"""
+def class_from_genic(paramfile, verbose=False, config=None):
+    """Parse a GenIC parameter file and returns a dictionary to setup CLASS.
+        An already parsed configuration can be passed in config."""
 
     # read GenIC configuration file, and store information
-    config = read_genic_paramfile(paramfile,verbose)
+    if config is None:
+        config = read_genic_paramfile(paramfile,verbose)
 
     # rename parameters to be used in CLASS
     params = _build_cosmology_params_class(config)
@@ -136,11 +138,13 @@ def class_from_genic(paramfile, verbose=False):
     return params
 
 
-def camb_from_genic(paramfile, verbose=False):
-    """Parse a GenIC parameter file and returns a dictionary to setup CAMB"""
+def camb_from_genic(paramfile, verbose=False, config=None):
+    """Parse a GenIC parameter file and returns a dictionary to setup CAMB.
+        An already parsed configuration can be passed in config."""
 
     # read GenIC configuration file, and store information
-    config = read_genic_paramfile(paramfile,verbose)
+    if config is None:
+        config = read_genic_paramfile(paramfile,verbose)
 
     # rename parameters to be used in CAMB
     params = _build_cosmology_params_camb(config)
@@ -152,3 +156,17 @@ def camb_from_genic(paramfile, verbose=False):
 
     return params
 
+
+if __name__ ==  "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paramfile', type=str, help='genic paramfile')
+    parser.add_argument('--verbose', action='store_true', 
+            help='print runtime info',required=False)
+    args = parser.parse_args()
+
+    # parse file once, and use it to setup both codes
+    config = read_genic_paramfile(args.paramfile, args.verbose)
+    print('CAMB parameters',
+            camb_from_genic(args.paramfile, args.verbose, config=config))
+    print('CLASS parameters',
+            class_from_genic(args.paramfile, args.verbose, config=config))